@@ -2,12 +2,19 @@
 
 import sys
 import os
+import time
 import errno
 
 from random import random
 from logging import error
+from multiprocessing import Pool
 
-from sqlitedict import SqliteDict
+from sqlitedict import SqliteDict, decode
+
+from sqliteutil import DEFAULT_TABLE, connect_readonly
+
+# key ranges per worker in parallel export, for load balancing
+RANGES_PER_JOB = 16
 
 
 def argparser():
@@ -21,6 +28,8 @@ def argparser():
                     type=float, help='output random RATIO of documents')
     ap.add_argument('-P', '--dir-prefix', type=int, default=None,
                     help='add subdirectory with document ID prefix')
+    ap.add_argument('-j', '--jobs', type=int, default=1,
+                    help='number of parallel workers for --directory export')
     ap.add_argument('db', metavar='DB', help='database file')
     ap.add_argument('keys', metavar='KEY', nargs='*', help='keys to look up')
     return ap
@@ -68,6 +77,62 @@ def output(key, value, options):
 output.known_directories = set()
 
 
+def init_worker(dbname):
+    init_worker.connection = connect_readonly(dbname)
+init_worker.connection = None
+
+
+def export_range(args):
+    """Write documents with rowid in [first, last] and return count."""
+    first, last, options = args
+    cursor = init_worker.connection.execute(
+        'SELECT key, value FROM "{}" WHERE rowid BETWEEN ? AND ?'.format(
+            DEFAULT_TABLE), (first, last))
+    count = 0
+    for k, v in cursor:
+        if options.random is not None and options.random < random():
+            continue
+        path = document_path(k, options)
+        with open(path, 'w', encoding='utf-8') as out:
+            write(out, k, decode(v).rstrip('\n'), options)
+        count += 1
+    return count
+
+
+def parallel_export(dbname, options):
+    """Export DB to --directory with key ranges split over workers."""
+    connection = connect_readonly(dbname)
+    # create all output directories up front so workers only write files
+    directories, total = set([options.directory]), 0
+    for k, in connection.execute('SELECT key FROM "{}"'.format(DEFAULT_TABLE)):
+        directories.add(os.path.dirname(document_path(k, options)))
+        total += 1
+    for directory in directories:
+        mkdir_p(directory)
+    first, last = connection.execute('SELECT MIN(rowid), MAX(rowid) FROM '
+                                      '"{}"'.format(DEFAULT_TABLE)).fetchone()
+    connection.close()
+    if total == 0:
+        return
+    step = max(1, (last-first+1) // (options.jobs*RANGES_PER_JOB) + 1)
+    ranges = [
+        (i, min(i+step-1, last), options) for i in range(first, last+1, step)
+    ]
+    start, done = time.time(), 0
+    with Pool(options.jobs, init_worker, (dbname,)) as pool:
+        for count in pool.imap_unordered(export_range, ranges):
+            done += count
+            elapsed = time.time() - start
+            rate = done/elapsed if elapsed else 0
+            if options.random is None:
+                progress = '{}/{}'.format(done, total)
+            else:
+                progress = str(done)    # total unknown with --random
+            print('\rExported {} files ({:.1f} files/sec)'.format(
+                progress, rate), end='', file=sys.stderr)
+    print('', file=sys.stderr)
+
+
 def list_db(dbname, options):
     # No context manager (and no close()) as this is read-only and
     # close() can block for a long time for no apparent reason.
@@ -96,6 +161,16 @@ def main(argv):
     if not os.path.exists(args.db):
         print('no such file: {}'.format(args.db), file=sys.stderr)
         return 1
+    if args.jobs < 1:
+        print('error: must have at least one job for --jobs', file=sys.stderr)
+        return 1
+    if args.jobs > 1 and (args.directory is None or args.keys):
+        print('error: --jobs only supported for --directory export of '
+              'all keys', file=sys.stderr)
+        return 1
+    if args.jobs > 1:
+        parallel_export(args.db, args)
+        return 0
     try:
         list_db(args.db, args)
     except BrokenPipeError:
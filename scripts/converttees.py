@@ -3,14 +3,20 @@
 import os
 import sys
 import gzip
+import re
 import errno
+import bisect
+import heapq
+import hashlib
 import traceback
 
 import xml.etree.ElementTree as ET
 
+from array import array
+from itertools import chain
 from contextlib import contextmanager
 from abc import ABC, abstractmethod
-from logging import warn, error
+from logging import warning, error
 
 from teesxml import Document, Sentence, Entity, Token, Phrase, Dependency
 from teesxml import FormatError
@@ -18,6 +24,20 @@ from teesxml import FormatError
 
 DEFAULT_OUT='converted'
 
+# used with --delta to store per-document fingerprints
+FINGERPRINT_FILE = 'fingerprints.tsv'
+FINGERPRINT_TABLE = 'fingerprints'
+
+# raw <document> boundaries for fingerprinting, see DocumentHashingStream
+DOCUMENT_START_RE = re.compile(rb'<document[\s/>]')
+DOCUMENT_END_RE = re.compile(rb'</document\s*>')
+READ_SIZE = 64 * 1024
+
+# used with --compact-ids
+NUMERIC_ID_RE = re.compile(r'(0|[1-9][0-9]*)\Z')
+MAX_NUMERIC_ID = 2**64 - 1
+ID_SORT_CHUNK = 1000000
+
 # used with --retype
 TYPE_MAP = {
     'cel': 'Cell',
@@ -34,8 +54,17 @@ def argparser():
                     help='Input TEES XML files')
     ap.add_argument('-i', '--ids', metavar='ID[,ID ...]', default=None,
                     help='Only output documents with given IDs')
+    ap.add_argument('-I', '--ids-file', metavar='FILE', default=None,
+                    action='append',
+                    help='Only output documents with IDs in FILE (one per line)')
+    ap.add_argument('-x', '--exclude-ids-file', metavar='FILE', default=None,
+                    action='append',
+                    help='Do not output documents with IDs in FILE')
+    ap.add_argument('-C', '--compact-ids', default=False, action='store_true',
+                    help='Store numeric IDs in sorted array (less memory)')
     ap.add_argument('-l', '--limit', default=None, type=int,
-                    help='Maximum number of documents to process')
+                    help='Maximum number of documents to convert (not '+
+                    'counting unchanged documents with --delta)')
     ap.add_argument('-o', '--output', default=DEFAULT_OUT,
                     help='Output dir/db (default {})'.format(DEFAULT_OUT))
     ap.add_argument('-O', '--no-output', default=False, action='store_true',
@@ -58,6 +87,15 @@ def argparser():
                     help='Do not output tokens (implies --no-deps)')
     ap.add_argument('-T', '--retype', default=False, action='store_true',
                     help='Rename types (e.g. "dis" -> "Disease")')
+    ap.add_argument('-u', '--delta', default=False, action='store_true',
+                    help='Only write documents added or changed since '+
+                    'previous --delta conversion to same output')
+    ap.add_argument('-R', '--delete-removed', default=False,
+                    action='store_true',
+                    help='With --delta, delete output for removed documents')
+    ap.add_argument('-c', '--changelog', metavar='FILE', default=None,
+                    help='With --delta, write changed IDs to FILE ("-" '+
+                    'for stdout)')
     return ap
 
 
@@ -101,12 +139,213 @@ def document_path(doc_id, options):
         return doc_id[:options.dir_prefix]
 
 
+def read_ids(fn):
+    """Yield non-empty lines from file with one ID per line."""
+    if not fn.endswith('.gz'):
+        f = open(fn, encoding='utf-8')
+    else:
+        f = gzip.open(fn, 'rt', encoding='utf-8')
+    with f:
+        for l in f:
+            l = l.strip()
+            if l:
+                yield l
+
+
+class SortedIdArray(object):
+    """Memory-compact set of numeric IDs (e.g. PMIDs) in sorted array."""
+    def __init__(self, ids):
+        # sort in chunks and merge to avoid a list of all IDs as ints
+        chunks, chunk = [], array('Q')
+        for i in ids:
+            chunk.append(self.parse(i))
+            if len(chunk) >= ID_SORT_CHUNK:
+                chunks.append(array('Q', sorted(chunk)))
+                chunk = array('Q')
+        chunks.append(array('Q', sorted(chunk)))
+        self.values = array('Q', heapq.merge(*chunks))
+
+    @staticmethod
+    def parse(id_):
+        """Return ID as int, ValueError if int would not match as string."""
+        if NUMERIC_ID_RE.match(id_) is None:
+            if re.match(r'[0-9]+\Z', id_):
+                raise ValueError('non-canonical numeric ID {} (leading '
+                                 'zero)'.format(id_))
+            raise ValueError('non-numeric ID {}'.format(id_))
+        value = int(id_)
+        if value > MAX_NUMERIC_ID:
+            raise ValueError('ID out of range {}'.format(id_))
+        return value
+
+    def __contains__(self, id_):
+        if id_ is None:
+            return False
+        try:
+            value = self.parse(id_)
+        except ValueError:
+            return False
+        i = bisect.bisect_left(self.values, value)
+        return i < len(self.values) and self.values[i] == value
+
+    def __len__(self):
+        return len(self.values)
+
+
+def load_ids(ids, filenames, options):
+    """Return set-like container of ids and IDs read from filenames."""
+    def all_ids():
+        return chain(ids, *(read_ids(fn) for fn in filenames))
+    if options.compact_ids:
+        try:
+            return SortedIdArray(all_ids())
+        except ValueError as e:
+            warning('{}, ignoring --compact-ids'.format(e))
+    return set(all_ids())
+
+
+def wanted_id(doc_id, options):
+    if options.ids is not None and doc_id not in options.ids:
+        return False
+    if options.exclude_ids is not None and doc_id in options.exclude_ids:
+        return False
+    return True
+
+
+def output_signature(options):
+    """Return string identifying options that affect output content."""
+    return repr((
+        options.recover,
+        options.retype,
+        options.phrases,
+        options.phrase_types,
+        options.sentences,
+        options.no_deps,
+        options.no_tokens,
+        options.dir_prefix,
+    ))
+
+
+def document_fingerprint(raw_digest, options):
+    """Return hash of raw document bytes digest and output options."""
+    h = hashlib.sha1(output_signature(options).encode('utf-8'))
+    h.update(raw_digest.encode('ascii'))
+    return h.hexdigest()
+
+
+class DocumentHashingStream(object):
+    """Iterparse-like (event, element) stream that also hashes raw bytes.
+
+    The input is split on <document> boundaries as it is fed to the
+    parser, and the SHA-1 of the raw bytes of the most recently closed
+    document is available as `digest` when its end event is yielded.
+    """
+    def __init__(self, source, events):
+        self.source = source
+        self.parser = ET.XMLPullParser(events)
+        self.digest = None
+
+    def __iter__(self):
+        buf, hasher = b'', None
+        # keep enough unconsumed bytes to match a tag split across reads
+        keep = 32
+        while True:
+            data = self.source.read(READ_SIZE)
+            buf += data
+            while True:
+                if hasher is None:
+                    m = DOCUMENT_START_RE.search(buf)
+                    if m is None:
+                        break
+                    self.parser.feed(buf[:m.start()])
+                    yield from self.parser.read_events()
+                    buf, hasher = buf[m.start():], hashlib.sha1()
+                else:
+                    m = DOCUMENT_END_RE.search(buf)
+                    if m is None:
+                        break
+                    hasher.update(buf[:m.end()])
+                    self.parser.feed(buf[:m.end()])
+                    self.digest = hasher.hexdigest()
+                    yield from self.parser.read_events()
+                    buf, hasher = buf[m.end():], None
+            if not data:
+                break
+            if len(buf) > keep:
+                if hasher is not None:
+                    hasher.update(buf[:-keep])
+                self.parser.feed(buf[:-keep])
+                yield from self.parser.read_events()
+                buf = buf[-keep:]
+        self.parser.feed(buf)
+        self.parser.close()
+        yield from self.parser.read_events()
+
+
+class DeltaTracker(object):
+    """Compares documents against fingerprints of previous conversion."""
+    def __init__(self, previous):
+        self.previous = previous    # {doc_id: (fingerprint, paths)}
+        self.current = {}
+        self.added, self.changed, self.unchanged = [], [], []
+
+    def check(self, doc_id, fingerprint):
+        """Return True if document needs to be (re)written."""
+        if doc_id not in self.previous:
+            return True
+        return self.previous[doc_id][0] != fingerprint
+
+    def record(self, doc_id, fingerprint, paths):
+        if doc_id not in self.previous:
+            self.added.append(doc_id)
+        else:
+            self.changed.append(doc_id)
+        self.current[doc_id] = (fingerprint, paths)
+
+    def keep(self, doc_id):
+        """Carry over previous fingerprint for unchanged or failed doc."""
+        if doc_id in self.previous:
+            self.current[doc_id] = self.previous[doc_id]
+
+    def skip(self, doc_id):
+        self.unchanged.append(doc_id)
+        self.keep(doc_id)
+
+    def stale_paths(self, doc_id):
+        """Return previously written paths not written for doc_id now."""
+        if doc_id not in self.previous or doc_id not in self.current:
+            return []
+        current = set(self.current[doc_id][1])
+        return [p for p in self.previous[doc_id][1] if p not in current]
+
+    def removed(self):
+        return [i for i in self.previous if i not in self.current]
+
+    def changelog_lines(self, removed):
+        for status, ids in (('added', self.added), ('changed', self.changed),
+                            ('removed', removed)):
+            for doc_id in ids:
+                yield '{}\t{}'.format(status, doc_id)
+
+
 class WriterBase(ABC):
     """Abstracts over filesystem and DB for output."""
     @abstractmethod
     def open(path):
         pass
 
+    @abstractmethod
+    def remove(path):
+        pass
+
+    @abstractmethod
+    def load_fingerprints():
+        pass
+
+    @abstractmethod
+    def save_fingerprints(fingerprints):
+        pass
+
 
 class FilesystemWriter(WriterBase):
     def __init__(self, base_dir=None):
@@ -121,8 +360,7 @@ class FilesystemWriter(WriterBase):
 
     @contextmanager
     def open(self, path):
-        if self.base_dir is not None and not os.path.isabs(path):
-            path = os.path.join(self.base_dir, path)
+        path = self._path(path)
         directory = os.path.dirname(path)
         if directory not in self.known_directories:
             mkdir_p(directory)
@@ -133,6 +371,41 @@ class FilesystemWriter(WriterBase):
         finally:
             f.close()
 
+    def _path(self, path):
+        if self.base_dir is not None and not os.path.isabs(path):
+            path = os.path.join(self.base_dir, path)
+        return path
+
+    def remove(self, path):
+        try:
+            os.remove(self._path(path))
+        except FileNotFoundError:
+            warning('cannot remove {}: no such file'.format(path))
+
+    def load_fingerprints(self):
+        fingerprints = {}
+        path = self._path(FINGERPRINT_FILE)
+        if not os.path.exists(path):
+            return fingerprints
+        with open(path, encoding='utf-8') as f:
+            for ln, l in enumerate(f, start=1):
+                fields = l.rstrip('\n').split('\t')
+                if len(fields) != 3:
+                    raise FormatError('line {} in {}: {}'.format(ln, path, l))
+                doc_id, fingerprint, paths = fields
+                paths = paths.split(',') if paths else []
+                fingerprints[doc_id] = (fingerprint, paths)
+        return fingerprints
+
+    def save_fingerprints(self, fingerprints):
+        path = self._path(FINGERPRINT_FILE)
+        mkdir_p(os.path.dirname(os.path.abspath(path)))
+        with open(path + '.tmp', 'w', encoding='utf-8') as out:
+            for doc_id, (fingerprint, paths) in sorted(fingerprints.items()):
+                out.write('{}\t{}\t{}\n'.format(doc_id, fingerprint,
+                                               ','.join(paths)))
+        os.replace(path + '.tmp', path)
+
 
 class SQLiteFile(object):
     """Minimal file-like object that writes into SQLite DB"""
@@ -157,6 +430,7 @@ class SQLiteWriter(WriterBase):
     def __init__(self, dbname):
         self.dbname = dbname
         self.db = None
+        self.fingerprint_db = None
 
     def __enter__(self):
         try:
@@ -178,6 +452,32 @@ class SQLiteWriter(WriterBase):
         finally:
             f.close()
 
+    def remove(self, path):
+        try:
+            del self.db[path]
+        except KeyError:
+            warning('cannot remove {}: no such key'.format(path))
+
+    def _fingerprint_db(self):
+        # opened only when needed so plain conversions do not create it
+        if self.fingerprint_db is None:
+            import sqlitedict
+            self.fingerprint_db = sqlitedict.SqliteDict(
+                self.dbname, tablename=FINGERPRINT_TABLE, autocommit=False)
+        return self.fingerprint_db
+
+    def load_fingerprints(self):
+        return dict(self._fingerprint_db().iteritems())
+
+    def save_fingerprints(self, fingerprints):
+        db = self._fingerprint_db()
+        for doc_id in db.keys():
+            if doc_id not in fingerprints:
+                del db[doc_id]
+        for doc_id, value in fingerprints.items():
+            db[doc_id] = value
+        db.commit()
+
 
 def write_sentence(writer, sentence, doc_id, sent_seq, fn, options):
     doc_path = document_path(doc_id, options)
@@ -187,12 +487,17 @@ def write_sentence(writer, sentence, doc_id, sent_seq, fn, options):
         out.write(sentence.text + '\n')
     with writer.open(ann_fn) as out:
         write_annotations(sentence, out, 0, options)
+    return [txt_fn, ann_fn]
 
 
 def write_document(writer, document, fn, options):
+    """Write document and return list of written paths."""
     if options.sentences:
+        paths = []
         for i, s in enumerate(document.sentences):
-            write_sentence(writer, s, document.orig_id, i, fn, options)
+            paths.extend(write_sentence(writer, s, document.orig_id, i, fn,
+                                        options))
+        return paths
     else:
         doc_path = document_path(document.orig_id, options)
         txt_fn = os.path.join(doc_path, document.orig_id + '.txt')
@@ -202,46 +507,125 @@ def write_document(writer, document, fn, options):
         with writer.open(ann_fn) as out:
             for s in document.sentences:
                 write_annotations(s, out, s.start, options)
+        return [txt_fn, ann_fn]
 
 
-def process_stream(writer, stream, fn, options):
+def process_stream(writer, stream, fn, options, delta=None):
     success, error = 0, 0
+    root, skipping = None, False
     for event, element in stream:
         if options.limit is not None and success >= options.limit:
             break
-        if event == 'end' and element.tag == 'document':
+        if event == 'start':
+            if root is None:
+                root = element
+            elif element.tag == 'document':
+                skipping = not wanted_id(element.attrib.get('origId'), options)
+            continue
+        if skipping:
+            # Filtered document: free each subtree as soon as it is
+            # complete instead of building the full document first.
+            element.clear()
+            if element.tag == 'document':
+                skipping = False
+                del root[:]
+            continue
+        if element.tag == 'document':
             doc_id = element.attrib.get('origId')
-            if options.ids is not None and doc_id not in options.ids:
-                continue
+            if delta is not None:
+                fingerprint = document_fingerprint(stream.digest, options)
+                if not delta.check(doc_id, fingerprint):
+                    # unchanged: not counted as converted or for --limit
+                    delta.skip(doc_id)
+                    element.clear()
+                    del root[:]
+                    continue
             try:
                 document = Document.from_xml(element, options)
             except FormatError as e:
                 print('Failed to parse document {}:'.format(doc_id),
                       file=sys.stderr)
                 traceback.print_exc()
+                if delta is not None:
+                    delta.keep(doc_id)
                 error += 1
             else:
                 if not options.no_output:
-                    write_document(writer, document, fn, options)
+                    paths = write_document(writer, document, fn, options)
+                else:
+                    paths = []
+                if delta is not None:
+                    delta.record(doc_id, fingerprint, paths)
+                    if not options.no_output:
+                        for path in delta.stale_paths(doc_id):
+                            writer.remove(path)
                 success += 1
             element.clear()
+            del root[:]    # drop processed documents from the tree
         else:
             pass    # TODO others?
     return success, error
 
 
-def process(writer, fn, options):
+def iterparse(source, events, delta=None):
+    if delta is None:
+        return ET.iterparse(source, events)
+    else:
+        return DocumentHashingStream(source, events)
+
+
+def process(writer, fn, options, delta=None):
+    events = ('start', 'end')
     if not fn.endswith('.gz'):
-        return process_stream(writer, ET.iterparse(fn), fn, options)
+        with open(fn, 'rb') as source:
+            return process_stream(writer, iterparse(source, events, delta),
+                                  fn, options, delta)
     else:
-        with gzip.GzipFile(fn) as stream:
-            return process_stream(writer, ET.iterparse(stream), fn, options)
+        with gzip.GzipFile(fn) as source:
+            return process_stream(writer, iterparse(source, events, delta),
+                                  fn, options, delta)
+
+
+def finish_delta(writer, delta, options):
+    """Remove deleted documents, save fingerprints and write changelog."""
+    if (options.ids is None and options.exclude_ids is None and
+        options.limit is None):
+        removed = delta.removed()
+    else:
+        warning('not checking for removed documents with ID filters or --limit')
+        removed = []
+    if not options.no_output:
+        fingerprints = dict(delta.previous)
+        fingerprints.update(delta.current)
+        if options.delete_removed:
+            for doc_id in removed:
+                for path in fingerprints.pop(doc_id)[1]:
+                    writer.remove(path)
+        writer.save_fingerprints(fingerprints)
+    if options.changelog == '-':
+        write_lines(delta.changelog_lines(removed), sys.stdout)
+    elif options.changelog is not None:
+        with open(options.changelog, 'w', encoding='utf-8') as out:
+            write_lines(delta.changelog_lines(removed), out)
+    print('Delta: {} added, {} changed, {} unchanged, {} removed{}'.format(
+        len(delta.added), len(delta.changed), len(delta.unchanged),
+        len(removed), ' (deleted)' if options.delete_removed else ''),
+          file=sys.stderr)
 
 
 def main(argv):
     args = argparser().parse_args(argv[1:])
-    if args.ids is not None:
-        args.ids = args.ids.split(',')
+    if not args.delta and (args.delete_removed or args.changelog is not None):
+        print('error: --delete-removed and --changelog require --delta',
+              file=sys.stderr)
+        return 1
+    if args.ids is not None or args.ids_file is not None:
+        ids = args.ids.split(',') if args.ids is not None else []
+        args.ids = load_ids(ids, args.ids_file or [], args)
+    if args.exclude_ids_file is not None:
+        args.exclude_ids = load_ids([], args.exclude_ids_file, args)
+    else:
+        args.exclude_ids = None
     if args.phrase_types is not None:
         args.phrases = True
         args.phrase_types = args.phrase_types.split(',')
@@ -255,10 +639,24 @@ def main(argv):
             name = name + '.sqlite'
 
     with Writer(name) as writer:
+        if args.delta:
+            delta = DeltaTracker(writer.load_fingerprints())
+        else:
+            delta = None
         for fn in args.files:
-            success, error = process(writer, fn, args)
-            print('Converted {} documents (failed on {}) from {}'.\
-                  format(success, error, fn), file=sys.stderr)
+            if delta is not None:
+                unchanged = len(delta.unchanged)
+            success, error = process(writer, fn, args, delta)
+            if delta is None:
+                print('Converted {} documents (failed on {}) from {}'.\
+                      format(success, error, fn), file=sys.stderr)
+            else:
+                unchanged = len(delta.unchanged) - unchanged
+                print('Converted {} documents (failed on {}, skipped {} '
+                      'unchanged) from {}'.format(success, error, unchanged,
+                                                  fn), file=sys.stderr)
+        if delta is not None:
+            finish_delta(writer, delta, args)
     return 0
 
 
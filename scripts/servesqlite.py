@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import json
+import stat
+import time
+import signal
+import socket
+import threading
+
+from queue import Queue
+from collections import OrderedDict, Counter, deque
+from contextlib import contextmanager
+from socketserver import ThreadingMixIn, UnixStreamServer
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+
+from sqlitedict import SqliteDict
+
+
+DEFAULT_HOST = 'localhost'
+DEFAULT_PORT = 8080
+
+# number of most recent request latencies kept for percentiles
+LATENCY_WINDOW = 10000
+
+
+def argparser():
+    from argparse import ArgumentParser
+    ap = ArgumentParser(description='Serve values from SQLiteDict DBs.')
+    ap.add_argument('-H', '--host', default=DEFAULT_HOST,
+                    help='host to bind (default {})'.format(DEFAULT_HOST))
+    ap.add_argument('-p', '--port', type=int, default=DEFAULT_PORT,
+                    help='port to bind (default {})'.format(DEFAULT_PORT))
+    ap.add_argument('-u', '--unix-socket', metavar='PATH', default=None,
+                    help='serve on Unix socket PATH instead of TCP')
+    ap.add_argument('-n', '--connections', type=int, default=4,
+                    help='read-only connections per DB (default 4)')
+    ap.add_argument('-c', '--cache-size', type=int, default=10000,
+                    help='maximum number of cached values (default 10000)')
+    ap.add_argument('-v', '--verbose', default=False, action='store_true',
+                    help='log requests')
+    ap.add_argument('db', metavar='[NAME=]DB', nargs='+',
+                    help='database file, optionally with name (default '+
+                    'file basename without .sqlite)')
+    return ap
+
+
+class ConnectionPool(object):
+    """Fixed-size pool of read-only connections to a SQLiteDict DB."""
+    def __init__(self, dbname, size):
+        self.dbname = dbname
+        self.connections = Queue()
+        for i in range(size):
+            # No close() as these are read-only and close() can block
+            # for a long time for no apparent reason.
+            db = SqliteDict(dbname, flag='r', autocommit=False)
+            self.connections.put(db)
+
+    @contextmanager
+    def connection(self):
+        db = self.connections.get()
+        try:
+            yield db
+        finally:
+            self.connections.put(db)
+
+
+class LRUCache(object):
+    """Thread-safe least recently used cache of DB values."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class Metrics(object):
+    """Request counts and latencies by endpoint."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.total = Counter()
+        self.max = Counter()
+        self.recent = {}
+        self.statuses = Counter()
+        self.started = time.time()
+
+    def add(self, endpoint, status, latency):
+        with self.lock:
+            self.counts[endpoint] += 1
+            self.total[endpoint] += latency
+            self.max[endpoint] = max(self.max[endpoint], latency)
+            if endpoint not in self.recent:
+                self.recent[endpoint] = deque(maxlen=LATENCY_WINDOW)
+            self.recent[endpoint].append(latency)
+            self.statuses[status] += 1
+
+    @staticmethod
+    def percentile(values, p):
+        return values[min(len(values)-1, int(p * len(values)))]
+
+    def stats(self):
+        with self.lock:
+            endpoints = {}
+            for e, count in self.counts.items():
+                recent = sorted(self.recent[e])
+                endpoints[e] = {
+                    'requests': count,
+                    'mean_ms': 1000 * self.total[e] / count,
+                    'p50_ms': 1000 * self.percentile(recent, 0.50),
+                    'p95_ms': 1000 * self.percentile(recent, 0.95),
+                    'p99_ms': 1000 * self.percentile(recent, 0.99),
+                    'max_ms': 1000 * self.max[e],
+                }
+            return {
+                'uptime_s': time.time() - self.started,
+                'statuses': { str(k): v for k, v in self.statuses.items() },
+                'endpoints': endpoints,
+            }
+
+
+class DocumentStore(object):
+    """Cached lookup of values by key over pooled DB connections."""
+    def __init__(self, pools, cache):
+        self.pools = pools    # {name: ConnectionPool}
+        self.cache = cache
+
+    def get(self, name, keys):
+        """Return {key: value} for keys found in named DB."""
+        pool = self.pools[name]
+        found, missing = {}, []
+        for k in keys:
+            try:
+                found[k] = self.cache.get((name, k))
+            except KeyError:
+                missing.append(k)
+        if missing:
+            with pool.connection() as db:
+                for k in missing:
+                    try:
+                        v = db[k]
+                    except KeyError:
+                        continue
+                    self.cache.put((name, k), v)
+                    found[k] = v
+        return found
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Serves /db/NAME/KEY, /batch and /metrics."""
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/', 2)
+        if len(parts) == 3 and parts[0] == 'db':
+            self.timed('db', self.get_value, parts[1], unquote(parts[2]))
+        elif parts == ['batch']:
+            query = parse_qs(url.query)
+            names = query.get('db', [])
+            if len(names) != 1:
+                self.timed('batch', self.send_error, 400,
+                           'need exactly one db parameter')
+            else:
+                self.timed('batch', self.get_batch, names[0],
+                           query.get('key', []))
+        elif parts == ['metrics']:
+            self.timed('metrics', self.get_metrics)
+        else:
+            self.timed('other', self.send_error, 404)
+
+    def do_POST(self):
+        if urlparse(self.path).path.strip('/') != 'batch':
+            return self.timed('other', self.send_error, 404)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            name, keys = request['db'], request['keys']
+            if not (isinstance(name, str) and isinstance(keys, list) and
+                    all(isinstance(k, str) for k in keys)):
+                raise TypeError('db must be string and keys list of strings')
+        except (ValueError, KeyError, TypeError):
+            return self.timed('batch', self.send_error, 400,
+                              'expected {"db": NAME, "keys": [KEY, ...]}')
+        self.timed('batch', self.get_batch, name, keys)
+
+    def timed(self, endpoint, method, *args):
+        start = time.perf_counter()
+        self.status = None
+        method(*args)
+        self.server.metrics.add(endpoint, self.status,
+                                time.perf_counter() - start)
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+
+    def send_body(self, body, content_type):
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def get_value(self, name, key):
+        if name not in self.server.store.pools:
+            return self.send_error(404, 'no such db: {}'.format(name))
+        found = self.server.store.get(name, [key])
+        if key not in found:
+            return self.send_error(404, 'no such key: {}'.format(key))
+        self.send_body(found[key], 'text/plain; charset=utf-8')
+
+    def get_batch(self, name, keys):
+        if name not in self.server.store.pools:
+            return self.send_error(404, 'no such db: {}'.format(name))
+        found = self.server.store.get(name, keys)
+        result = { k: found.get(k) for k in keys }
+        self.send_body(json.dumps(result), 'application/json')
+
+    def get_metrics(self):
+        stats = self.server.metrics.stats()
+        stats['cache'] = self.server.store.cache.stats()
+        stats['dbs'] = {
+            n: p.dbname for n, p in self.server.store.pools.items()
+        }
+        self.send_body(json.dumps(stats, indent=2), 'application/json')
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return self.server.server_address    # Unix socket
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def parse_db_arg(arg):
+    if '=' in arg:
+        name, dbname = arg.split('=', 1)
+    else:
+        dbname = arg
+        name = os.path.basename(dbname)
+        if name.endswith('.sqlite'):
+            name = name[:-len('.sqlite')]
+    return name, dbname
+
+
+def socket_in_use(path):
+    """Return True if a server accepts connections on Unix socket path."""
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+    except ConnectionRefusedError:
+        return False
+    finally:
+        s.close()
+    return True
+
+
+def remove_socket(path, inode):
+    """Remove Unix socket at path unless replaced by another file."""
+    try:
+        if os.stat(path).st_ino == inode:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    if args.connections < 1:
+        print('error: must have at least one connection', file=sys.stderr)
+        return 1
+    pools = {}
+    for arg in args.db:
+        name, dbname = parse_db_arg(arg)
+        if not os.path.exists(dbname):
+            print('no such file: {}'.format(dbname), file=sys.stderr)
+            return 1
+        if name in pools:
+            print('duplicate db name: {}'.format(name), file=sys.stderr)
+            return 1
+        pools[name] = ConnectionPool(dbname, args.connections)
+
+    if args.unix_socket is not None and os.path.exists(args.unix_socket):
+        if not stat.S_ISSOCK(os.stat(args.unix_socket).st_mode):
+            print('error: {} exists and is not a socket'.format(
+                args.unix_socket), file=sys.stderr)
+            return 1
+        if socket_in_use(args.unix_socket):
+            print('error: server already listening on {}'.format(
+                args.unix_socket), file=sys.stderr)
+            return 1
+        os.remove(args.unix_socket)    # stale socket from earlier run
+
+    if args.unix_socket is None:
+        server = ThreadingHTTPServer((args.host, args.port), RequestHandler)
+        address = 'http://{}:{}'.format(args.host, args.port)
+    else:
+        server = ThreadingUnixHTTPServer(args.unix_socket, RequestHandler)
+        address = args.unix_socket
+        socket_inode = os.stat(args.unix_socket).st_ino
+    server.store = DocumentStore(pools, LRUCache(args.cache_size))
+    server.metrics = Metrics()
+    server.verbose = args.verbose
+    print('Serving {} on {}'.format(', '.join(sorted(pools)), address),
+          file=sys.stderr)
+    # exit through finally below to clean up on termination
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.unix_socket is not None:
+            remove_socket(args.unix_socket, socket_inode)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
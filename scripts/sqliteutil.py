@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+
+import sqlite3
+
+from pathlib import Path
+
+
+# SqliteDict default table name
+DEFAULT_TABLE = 'unnamed'
+
+
+def connect_readonly(dbname):
+    """Return read-only sqlite3 connection to existing DB file."""
+    # as_uri() escapes characters such as "?" and "#" in the path
+    uri = Path(dbname).resolve().as_uri() + '?mode=ro'
+    return sqlite3.connect(uri, uri=True)
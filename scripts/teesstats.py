@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import gzip
+import json
+import hashlib
+
+import xml.etree.ElementTree as ET
+
+from collections import Counter
+from multiprocessing import Pool
+from logging import error, warning
+
+from teesxml import Document, FormatError, get_norm_type
+from sqliteutil import DEFAULT_TABLE, connect_readonly
+
+
+# bump when statistics change to invalidate cached results
+STATS_VERSION = 2
+
+# rows per task when splitting SQLite DBs over workers
+SQLITE_CHUNK_SIZE = 10000
+
+CATEGORIES = [
+    'totals',
+    'entity_types',
+    'norm_types',
+    'pos_tags',
+    'dependency_types',
+    'phrase_types',
+    'tokens_per_sentence',
+    'unavailable',    # number of inputs lacking data for statistic
+]
+
+
+def argparser():
+    import argparse
+    ap = argparse.ArgumentParser(
+        description='Corpus statistics for TEES XML or converted SQLite DBs.')
+    ap.add_argument('files', metavar='FILE', nargs='+',
+                    help='Input TEES XML (.xml[.gz]) or SQLite DB (.sqlite)')
+    ap.add_argument('-c', '--cache', metavar='DIR', default=None,
+                    help='Cache per-file results in DIR')
+    ap.add_argument('-f', '--format', choices=['json', 'tsv'], default='json',
+                    help='Output format (default json)')
+    ap.add_argument('-j', '--jobs', type=int, default=1,
+                    help='Number of parallel workers')
+    ap.add_argument('-o', '--output', default=None,
+                    help='Output file (default stdout)')
+    ap.add_argument('-r', '--recover', default=False, action='store_true',
+                    help='Try to recover from parsing errors')
+    return ap
+
+
+def new_stats():
+    return { c: Counter() for c in CATEGORIES }
+
+
+def merge_stats(stats, other):
+    for c in CATEGORIES:
+        stats[c].update(other[c])
+    return stats
+
+
+def document_stats(document, stats):
+    stats['totals']['documents'] += 1
+    for s in document.sentences:
+        stats['totals']['sentences'] += 1
+        stats['tokens_per_sentence'][len(s.tokens)] += 1
+        for e in s.entities:
+            stats['totals']['entities'] += 1
+            stats['entity_types'][e.type] += 1
+            if e.norm_type is not None:
+                stats['totals']['normalized'] += 1
+                stats['norm_types'][e.norm_type] += 1
+        for t in s.tokens:
+            stats['totals']['tokens'] += 1
+            stats['pos_tags'][t.pos] += 1
+        for d in s.dependencies:
+            stats['dependency_types'][d.type] += 1
+        for p in s.phrases:
+            stats['phrase_types'][p.type] += 1
+
+
+def xml_stats(fn, options):
+    stats = new_stats()
+    if not fn.endswith('.gz'):
+        stream = open(fn, 'rb')
+    else:
+        stream = gzip.GzipFile(fn)
+    root = None
+    with stream:
+        for event, element in ET.iterparse(stream, ('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = element
+                continue
+            if element.tag != 'document':
+                continue
+            try:
+                document = Document.from_xml(element, options)
+            except FormatError as e:
+                error('failed to parse document {} in {}: {}'.format(
+                    element.attrib.get('origId'), fn, e))
+                stats['totals']['failed'] += 1
+            else:
+                document_stats(document, stats)
+            element.clear()
+            del root[:]    # drop processed documents from the tree
+    return stats
+
+
+def ann_stats(key, ann, stats):
+    """Add statistics for converted .ann data to stats."""
+    # key is DOCID.SEQ.ann with --sentences, DOCID.ann otherwise
+    per_sentence = key.count('.') > 1
+    if per_sentence:
+        stats['totals']['sentences'] += 1
+    else:
+        # sentence boundaries are not stored in document-level .ann
+        stats['unavailable']['sentences'] += 1
+        stats['unavailable']['tokens_per_sentence'] += 1
+    stats['unavailable']['pos_tags'] += 1    # POS tags are not stored
+    tokens = 0
+    for line in ann.splitlines():
+        if not line:
+            continue
+        fields = line.split('\t')
+        id_, annotation = fields[0], fields[1].split(' ')
+        if id_.startswith('T'):
+            type_ = annotation[0]
+            if type_ == 'Token':
+                tokens += 1
+            elif type_.startswith('Phrase-'):
+                stats['phrase_types'][type_[len('Phrase-'):]] += 1
+            else:
+                stats['totals']['entities'] += 1
+                stats['entity_types'][type_] += 1
+        elif id_.startswith('N'):
+            stats['totals']['normalized'] += 1
+            stats['norm_types'][get_norm_type(annotation[2])] += 1
+        elif id_.startswith('R'):
+            stats['dependency_types'][annotation[0]] += 1
+    stats['totals']['tokens'] += tokens
+    if per_sentence:
+        stats['tokens_per_sentence'][tokens] += 1
+
+
+def sqlite_stats(dbname, first, last):
+    from sqlitedict import decode
+    stats = new_stats()
+    connection = connect_readonly(dbname)
+    cursor = connection.execute(
+        'SELECT key, value FROM "{}" WHERE rowid BETWEEN ? AND ?'.format(
+            DEFAULT_TABLE), (first, last))
+    for key, value in cursor:
+        if key.endswith('.ann'):
+            ann_stats(key, decode(value), stats)
+        elif key.endswith('.txt') and (key.count('.') == 1 or
+                                       key.endswith('.0.txt')):
+            stats['totals']['documents'] += 1
+    connection.close()
+    return stats
+
+
+def run_task(task):
+    fn, rowids, options = task
+    if rowids is None:
+        stats = xml_stats(fn, options)
+    else:
+        stats = sqlite_stats(fn, *rowids)
+    return fn, stats
+
+
+def is_sqlite(fn):
+    return fn.endswith('.sqlite')
+
+
+def make_tasks(fn, options):
+    if not is_sqlite(fn):
+        return [(fn, None, options)]
+    connection = connect_readonly(fn)
+    first, last = connection.execute('SELECT MIN(rowid), MAX(rowid) FROM '
+                                     '"{}"'.format(DEFAULT_TABLE)).fetchone()
+    connection.close()
+    if first is None:
+        return []
+    return [
+        (fn, (i, min(i+SQLITE_CHUNK_SIZE-1, last)), options)
+        for i in range(first, last+1, SQLITE_CHUNK_SIZE)
+    ]
+
+
+def cache_path(fn, options):
+    key = hashlib.sha1(os.path.abspath(fn).encode('utf-8')).hexdigest()
+    return os.path.join(options.cache, key + '.json')
+
+
+def cache_signature(fn, options):
+    st = os.stat(fn)
+    return [STATS_VERSION, os.path.abspath(fn), st.st_size, st.st_mtime,
+            options.recover]
+
+
+def load_cached(fn, options):
+    path = cache_path(fn, options)
+    try:
+        with open(path, encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get('signature') != cache_signature(fn, options):
+        return None
+    stats = new_stats()
+    for c in CATEGORIES:
+        stats[c].update(cached['stats'][c])
+    # JSON object keys are strings
+    stats['tokens_per_sentence'] = Counter({
+        int(k): v for k, v in stats['tokens_per_sentence'].items()
+    })
+    return stats
+
+
+def save_cached(fn, stats, options):
+    path = cache_path(fn, options)
+    with open(path + '.tmp', 'w', encoding='utf-8') as out:
+        json.dump({
+            'signature': cache_signature(fn, options),
+            'stats': stats,
+        }, out)
+    os.replace(path + '.tmp', path)
+
+
+def compute_stats(files, options):
+    """Return merged stats for files, using cache if available."""
+    total, partial, pending, tasks = new_stats(), {}, Counter(), []
+    for fn in files:
+        cached = None
+        if options.cache is not None:
+            cached = load_cached(fn, options)
+        if cached is not None:
+            merge_stats(total, cached)
+            continue
+        partial[fn] = new_stats()
+        for task in make_tasks(fn, options):
+            tasks.append(task)
+            pending[fn] += 1
+    if options.jobs > 1:
+        pool = Pool(options.jobs)
+        results = pool.imap_unordered(run_task, tasks)
+    else:
+        pool = None
+        results = map(run_task, tasks)
+    for fn, stats in results:
+        merge_stats(partial[fn], stats)
+        pending[fn] -= 1
+        if pending[fn] == 0 and options.cache is not None:
+            save_cached(fn, partial[fn], options)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    for stats in partial.values():
+        merge_stats(total, stats)
+    return total
+
+
+def norm_coverage(stats):
+    entities = stats['totals']['entities']
+    return {
+        t: c/entities if entities else 0
+        for t, c in stats['norm_types'].items()
+    }
+
+
+def write_json(stats, out):
+    data = {
+        c: dict(sorted(stats[c].items(), key=lambda i: -i[1]))
+        for c in CATEGORIES if c != 'tokens_per_sentence'
+    }
+    data['tokens_per_sentence'] = dict(sorted(
+        stats['tokens_per_sentence'].items()))
+    data['norm_coverage'] = norm_coverage(stats)
+    json.dump(data, out, indent=2)
+    out.write('\n')
+
+
+def write_tsv(stats, out):
+    for c in CATEGORIES:
+        if c != 'tokens_per_sentence':
+            items = sorted(stats[c].items(), key=lambda i: -i[1])
+        else:
+            items = sorted(stats[c].items())
+        for k, v in items:
+            out.write('{}\t{}\t{}\n'.format(c, k, v))
+    for k, v in sorted(norm_coverage(stats).items()):
+        out.write('{}\t{}\t{:.4f}\n'.format('norm_coverage', k, v))
+
+
+def main(argv):
+    args = argparser().parse_args(argv[1:])
+    args.phrases = True    # Sentence.from_xml skips phrases otherwise
+    if args.jobs < 1:
+        print('error: must have at least one job for --jobs', file=sys.stderr)
+        return 1
+    for fn in args.files:
+        if not os.path.exists(fn):
+            print('no such file: {}'.format(fn), file=sys.stderr)
+            return 1
+    if args.cache is not None:
+        os.makedirs(args.cache, exist_ok=True)
+
+    stats = compute_stats(args.files, args)
+    for category, count in sorted(stats['unavailable'].items()):
+        warning('{} not available for {} converted .ann files, '
+                'omitted from their results'.format(category, count))
+
+    write = write_json if args.format == 'json' else write_tsv
+    if args.output is None:
+        write(stats, sys.stdout)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            write(stats, out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -53,6 +53,21 @@ def get_norm_curie(norm_type, norm_id):
         return '{}:{}'.format(norm_type, norm_id)
 
 
+def get_norm_type(norm_curie):
+    """Return EVEX normalization type for CURIE (see get_norm_curie)."""
+    prefix = norm_curie.split(':', 1)[0]
+    if prefix == 'NCBITaxon':
+        return 'ncbitax_id'
+    elif prefix == 'ncbigene':
+        return 'entrezgene_id'
+    elif prefix == 'cellosaurus':
+        return 'cellline_acc'
+    elif prefix in ('CHEBI', 'mesh'):
+        return 'cui'
+    else:
+        return prefix
+
+
 class FormatError(Exception):
     pass
 
@@ -210,7 +225,8 @@ class Span(object):
 
 
 class Entity(Span):
-    def __init__(self, id_, type_, offset, text, orig_id, norm_id, norm_conf):
+    def __init__(self, id_, type_, offset, text, orig_id, norm_id, norm_conf,
+                 norm_type=None):
         super(Entity, self).__init__(offset)
         self.id = id_
         self.type = type_
@@ -218,6 +234,7 @@ class Entity(Span):
         self.orig_id = orig_id
         self.norm_id = norm_id
         self.norm_conf = norm_conf
+        self.norm_type = norm_type
         self.norm_uid = None
 
     def assign_uids(self, next_free_idx):
@@ -243,8 +260,9 @@ class Entity(Span):
         offset = element.attrib['charOffset']
         text = element.attrib['text']
         orig_id = get_attrib(element, 'origId', options)
-        norm_id, norm_conf = Entity.get_normalization(element)
-        return cls(id_, type_, offset, text, orig_id, norm_id, norm_conf)
+        norm_type, norm_id, norm_conf = Entity.get_normalization(element)
+        return cls(id_, type_, offset, text, orig_id, norm_id, norm_conf,
+                   norm_type)
 
     @staticmethod
     def get_normalization(element):
@@ -272,14 +290,14 @@ class Entity(Span):
             else:
                 norm_confs.append((k, norms[k], confs[k]))
         if not norm_confs:
-            return None, None
+            return None, None, None
         else:
             if len(norm_confs) > 1:
                 warning('more than one norm, only using first: {}'.\
                         format(norm_confs))
             norm_type, norm_id, norm_conf = norm_confs[0]
             norm_curie = get_norm_curie(norm_type, norm_id)
-            return norm_curie, norm_conf
+            return norm_type, norm_curie, norm_conf
 
 
 class Token(Span):